@@ -2,23 +2,43 @@
 This module contains the main code for the RAG API
 """
 
+from __future__ import annotations
+import time
+_IMPORT_START = time.perf_counter()     # Inicio de la importacion, para medir el arranque
+
 import os
-from typing import Optional, List, Dict
+import tempfile
+import threading
+from typing import Optional, List, Dict, TYPE_CHECKING
 import json
-import polars as pl
 from werkzeug.utils import secure_filename
 from flask import Flask, request, jsonify
-from core import FileManager, AcceptedFiles, Another, OCR, TextChunk, MilvusManager, get_logger, delete_files_directory
+from core import FileManager, Another, OCR, TextChunk, MilvusManager, BlobStore, get_logger, delete_files_directory
+
+if TYPE_CHECKING:
+    import polars as pl
 
 
-UPLOAD_FOLDER = './uploads'
+UPLOAD_FOLDER = os.getenv('BLOB_STORE_DIR', './uploads')
+COLLECTION_NAME = 'collection'
 ALLOWED_EXTENSIONS = ['txt', 'html', 'md', 'java', 'py', 'c', 'cpp', 'js', 'pdf', 
                       'png', 'jpg', 'jpeg', 'ppt', 'pptx', 'doc', 'docx']
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-milvus_manager = MilvusManager()
+milvus_manager = MilvusManager()       # Los clientes se crean en el primer uso o en warm_up()
 logger = get_logger(__name__)
+startup_metrics = {
+    "import_seconds": None,
+    "first_request_seconds": None,
+    "first_request_since_start_seconds": None,
+    "warm_up_seconds": None,
+}
+_first_request_lock = threading.Lock()
+_warm_up_lock = threading.Lock()
+_warm_up_pid = None         # Proceso en el que ya se lanzo el warm-up (los workers se crean con fork)
+_blob_store: Optional[BlobStore] = None     # Se crea en el primer uso, importar app no toca el disco
+_blob_store_lock = threading.Lock()
 
 
 def allowed_file(filename: str, extensions: List[str]) -> bool:
@@ -39,31 +59,57 @@ def allowed_file(filename: str, extensions: List[str]) -> bool:
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in extensions
 
-def ensure_file_format(file: str) -> Optional[str]:
+def get_blob_store() -> BlobStore:
+    """
+    Function to get the blob store of the uploads, created on first use.
+
+    Returns:
+        BlobStore: The blob store of the uploads.
     """
-    Function to aplly the strategy pattern to move the file to the destination directory.
+
+    global _blob_store
+    if _blob_store is None:
+        with _blob_store_lock:
+            if _blob_store is None:
+                _blob_store = BlobStore(app.config['UPLOAD_FOLDER'])
+    return _blob_store
+
+def ensure_file_format(blob_id: str, lease: Optional[str] = None) -> Optional[str]:
+    """
+    Function to get a file in an accepted format from a blob of the store.
+    Accepted files are used directly, the rest are converted to PDF with the strategy pattern
+    and the PDF is kept in the store as an intermediate blob, so it is reused by later uploads.
 
     Args:
-        file (str): The path of the file.
+        blob_id (str): The id of the uploaded file in the blob store.
+        lease (Optional[str]): The lease of the upload, protects the intermediate PDF from the cleanup.
 
     Returns:
-        Optional[str]: The path of the file moved to the destination directory.
+        Optional[str]: The path of the file in an accepted format, or None if the conversion failed.
     """
 
-    file_manager = FileManager()
-    if allowed_file(file, ALLOWED_EXTENSIONS[:9]):
-        file_manager.set_strategy(AcceptedFiles())
-    else:
+    blob_store = get_blob_store()
+    path = blob_store.get_path(blob_id)
+    if allowed_file(path, ALLOWED_EXTENSIONS[:9]):
+        return path
+    derived = blob_store.get_derived(blob_id, lease)
+    if derived is None:
+        file_manager = FileManager()
         file_manager.set_strategy(Another())
-    path = file_manager.execute_strategy(file, dst_dir='./uploads/documents/')
-    return path
-
-def make_ocr(file: str) -> List[Dict]:
+        with tempfile.TemporaryDirectory(dir=blob_store.tmp_dir) as tmp_dir:
+            pdf = file_manager.execute_strategy(path, dst_path=os.path.join(tmp_dir, 'document.pdf'))
+            if pdf is None:
+                return None
+            derived = blob_store.put_file(pdf, kind=BlobStore.DERIVED, source=blob_id, lease=lease)
+    return blob_store.get_path(derived)
+
+def make_ocr(file: str, filename: str) -> List[Dict]:
     """
     Function to extract text from a file using OCR.
 
     Args:
         file (str): The path of the file.
+        filename (str): The original name of the file, saved in the metadata.
     
     Returns:
         List[Dict]: A list of dictionaries containing the text and metadata of the file.
@@ -73,6 +119,9 @@ def make_ocr(file: str) -> List[Dict]:
         data = OCR.get_ocr(file)
     else:
         data = OCR.get_dev_ocr(file)
+    # Los blobs se nombran por su contenido, guardar el nombre original del archivo
+    for item in data:
+        item['metadata']['filename'] = filename
     return data
 
 def get_text_chunks(ocr_text: List[Dict]) -> pl.DataFrame:
@@ -86,24 +135,31 @@ def get_text_chunks(ocr_text: List[Dict]) -> pl.DataFrame:
         pl.DataFrame: A Polars DataFrame with the text chunks
     """
 
+    import polars as pl
     data_df = pl.DataFrame({})
     df_text = TextChunk.add_chunks_to_dataframe(data_df, ocr_text)
     TextChunk.save_checkpoint(df_text, './data/checkpoint.db')
     return df_text
 
-def insert_points(df_points: pl.DataFrame) -> None:
+def insert_points(df_points: pl.DataFrame, blob_id: str, filename: str) -> None:
     """
-    Function to insert points in Milvus.
+    Function to insert points in Milvus and link the uploaded file to the ingested document.
 
     Args:
         df_points (pl.DataFrame): The DataFrame containing the text column.
+        blob_id (str): The id of the uploaded file in the blob store.
+        filename (str): The name of the document.
 
     Returns:
         None
     """
 
-    milvus_manager.create_collection("collection")
-    milvus_manager.insert_points("collection", df_points)
+    blob_store = get_blob_store()
+    milvus_manager.create_collection(COLLECTION_NAME)
+    # La coleccion se ha recreado: los documentos anteriores ya no estan ingestados
+    blob_store.drop_references(COLLECTION_NAME)
+    milvus_manager.insert_points(COLLECTION_NAME, df_points)
+    blob_store.add_reference(blob_id, COLLECTION_NAME, filename)
 
 def get_context(query: str) -> List[str]:
     """
@@ -116,7 +172,7 @@ def get_context(query: str) -> List[str]:
         List[str]: A list of strings with the context of the query.
     """
 
-    data = milvus_manager.search_points("collection", query)
+    data = milvus_manager.search_points(COLLECTION_NAME, query)
     points = json.loads(data)
     context = []
     for point in points[0]:
@@ -124,12 +180,91 @@ def get_context(query: str) -> List[str]:
     return context
 
 
-# Routes: /hello, /upload, /search
+def warm_up() -> None:
+    """
+    Function to create the clients and open the connections ahead of the first request.
+
+    Returns:
+        None
+    """
+
+    start = time.perf_counter()
+    try:
+        milvus_manager.warm_up()
+    except Exception as e:
+        logger.error("Error warming up: %s", e)
+        return
+    startup_metrics["warm_up_seconds"] = time.perf_counter() - start
+    logger.info("Warm-up finished in %.3fs", startup_metrics["warm_up_seconds"])
+
+def start_warm_up() -> Optional[threading.Thread]:
+    """
+    Function to run warm_up() once per process in a background thread.
+    It is called on the first request (e.g. the readiness probe), so it runs under any WSGI server.
+    It can also be called from a server hook, e.g. gunicorn's post_worker_init.
+
+    Returns:
+        Optional[threading.Thread]: The thread running the warm-up, or None if it was already started in this process.
+    """
+
+    global _warm_up_pid
+    if _warm_up_pid == os.getpid():
+        return None
+    with _warm_up_lock:
+        if _warm_up_pid == os.getpid():
+            return None
+        _warm_up_pid = os.getpid()
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+startup_metrics["import_seconds"] = time.perf_counter() - _IMPORT_START
+logger.info("App imported in %.3fs", startup_metrics["import_seconds"])
+
+
+@app.before_request
+def _start_request_timer():
+    request.environ['app.start_time'] = time.perf_counter()
+
+@app.before_request
+def _start_background_tasks():
+    # Se lanzan en la primera peticion de cada proceso, con cualquier servidor WSGI
+    start_warm_up()
+    get_blob_store().start_cleanup()
+
+@app.after_request
+def _measure_first_request(response):
+    if startup_metrics["first_request_seconds"] is None:
+        with _first_request_lock:
+            if startup_metrics["first_request_seconds"] is None:
+                now = time.perf_counter()
+                startup_metrics["first_request_seconds"] = now - request.environ.get('app.start_time', now)
+                startup_metrics["first_request_since_start_seconds"] = now - _IMPORT_START
+                logger.info("First request served in %.3fs (%.3fs since start)",
+                            startup_metrics["first_request_seconds"],
+                            startup_metrics["first_request_since_start_seconds"])
+    return response
+
+
+# Routes: /hello, /startup, /ocr/cache, /blobs, /upload, /search
 
 @app.get("/hello")
 def hello():
     return "<h1>Hello, World!</h1>"
 
+@app.get("/startup")
+def startup():
+    return jsonify(startup_metrics), 200
+
+@app.get("/ocr/cache")
+def ocr_cache_stats():
+    return jsonify(OCR.get_cache().stats()), 200
+
+@app.get("/blobs")
+def blob_store_stats():
+    return jsonify(get_blob_store().stats()), 200
+
 @app.post('/upload')
 def upload_file():
     # check if the post request has the file part
@@ -142,12 +277,17 @@ def upload_file():
     
     if file and allowed_file(file.filename, ALLOWED_EXTENSIONS):
         filename = secure_filename(file.filename)
-        path_file = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(path_file)
-        accepted_file = ensure_file_format(path_file)       # Ensure file format
-        text_file = make_ocr(accepted_file)                 # Extract text from file (OCR)
-        text_chunks = get_text_chunks(text_file)            # Get text chunks (pl.DataFrame)
-        insert_points(text_chunks)                          # Insert points in Milvus
+        extension = os.path.splitext(filename)[1]
+        # El lease evita que la limpieza borre los blobs mientras se procesan, se libera aunque falle
+        blob_store = get_blob_store()
+        with blob_store.lease() as lease:
+            blob_id = blob_store.put_stream(file.stream, extension, lease=lease)    # Save file in the blob store
+            accepted_file = ensure_file_format(blob_id, lease)                      # Ensure file format
+            if accepted_file is None:
+                return jsonify({"error": "The file could not be converted: 'file'"}), 500
+            text_file = make_ocr(accepted_file, filename)                           # Extract text from file (OCR)
+            text_chunks = get_text_chunks(text_file)                                # Get text chunks (pl.DataFrame)
+            insert_points(text_chunks, blob_id, filename)                           # Insert points in Milvus
         return jsonify({"message": "File uploaded successfully"}), 200
     else:
         return jsonify({"error": "Invalid file format: 'file'"}), 400
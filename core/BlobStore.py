@@ -0,0 +1,435 @@
+"""
+This module contains the BlobStore class, a content-addressed store for the uploaded files and the intermediate PDFs.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import uuid
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional
+from .utils import get_logger, connect_sqlite, sqlite_transaction
+
+
+logger = get_logger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+TMP_GRACE = 3600            # Los temporales mas recientes pueden ser de una subida o conversion en curso
+LEASE_TIMEOUT = 24 * 3600   # Leases de un proceso que termino sin liberarlos
+
+class BlobStore:
+    """
+    BlobStore class.
+    Files are stored once by the SHA-256 of their content and their extension in sharded directories
+    (objects/ab/cd/<digest><ext>); the file name is the id of the blob.
+    A SQLite index tracks the blobs, the intermediate PDF generated from each original and the documents that reference
+    them, so that a background cleanup can remove orphaned originals and intermediate PDFs according to the retention policy.
+    Blobs in use by an upload that is still being processed are protected by a lease (see lease()).
+    """
+
+    ORIGINAL = 'original'
+    DERIVED = 'derived'
+
+    def __init__(self, root: Optional[str] = None,
+                 orphan_retention: Optional[float] = None,
+                 derived_retention: Optional[float] = None):
+        """
+        Args:
+            root (Optional[str]): Root directory of the store, by default $BLOB_STORE_DIR or './uploads'
+            orphan_retention (Optional[float]): Seconds an unreferenced original is kept, by default $BLOB_ORPHAN_RETENTION or 1 day
+            derived_retention (Optional[float]): Seconds an intermediate PDF is kept after its last use, by default $BLOB_DERIVED_RETENTION or 1 day
+        """
+
+        self.root = Path(root if root is not None else os.getenv("BLOB_STORE_DIR", "./uploads"))
+        self.objects_dir = self.root / 'objects'
+        self.tmp_dir = self.root / 'tmp'
+        self.db_path = self.root / 'index.db'
+        self.orphan_retention = float(orphan_retention if orphan_retention is not None
+                                      else os.getenv("BLOB_ORPHAN_RETENTION", "86400"))
+        self.derived_retention = float(derived_retention if derived_retention is not None
+                                       else os.getenv("BLOB_DERIVED_RETENTION", "86400"))
+        self._stop_cleanup = threading.Event()
+        self._cleanup_thread = None
+        self._cleanup_lock = threading.Lock()
+        self._init_store()
+
+    def _init_store(self) -> None:
+        """
+        Create the directories and the tables of the index if they do not exist.
+
+        Returns:
+            None
+        """
+
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        with sqlite_transaction(self.db_path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, kind TEXT NOT NULL, "
+                "created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            # La derivacion se guarda aparte: un mismo blob puede ser original y PDF intermedio de otro
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS derivations ("
+                "source TEXT PRIMARY KEY, derived TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS refs ("
+                "blob TEXT NOT NULL, collection TEXT NOT NULL, document TEXT NOT NULL, created REAL NOT NULL, "
+                "PRIMARY KEY (blob, collection, document))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_collection ON refs (collection)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "lease TEXT NOT NULL, blob TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (lease, blob))"
+            )
+
+    def _blob_path(self, blob_id: str) -> Path:
+        """
+        Get the sharded path of a blob.
+
+        Args:
+            blob_id (str): The id of the blob, i.e. the SHA-256 of the content followed by the extension.
+
+        Returns:
+            Path: The path of the blob in the store.
+        """
+
+        return self.objects_dir / blob_id[:2] / blob_id[2:4] / blob_id
+
+    def _add(self, tmp_path: Path, digest: str, size: int, extension: str,
+             kind: str, source: Optional[str], lease: Optional[str]) -> str:
+        """
+        Move a hashed temporary file into the store, or discard it if the blob already exists.
+        The same content with another extension is a different blob, since the extension selects how it is processed.
+
+        Args:
+            tmp_path (Path): The temporary file with the content.
+            digest (str): The SHA-256 of the content.
+            size (int): The size of the content in bytes.
+            extension (str): The extension of the file.
+            kind (str): BlobStore.ORIGINAL or BlobStore.DERIVED.
+            source (Optional[str]): The id of the original blob, for derived blobs.
+            lease (Optional[str]): The lease that protects the blob from the cleanup.
+
+        Returns:
+            str: The id of the blob.
+        """
+
+        blob_id = f"{digest}{extension.lower()}"
+        path = self._blob_path(blob_id)
+        with sqlite_transaction(self.db_path) as conn:
+            now = time.time()
+            row = conn.execute("SELECT path, kind FROM blobs WHERE id = ?", (blob_id,)).fetchone()
+            if row is not None and Path(row[0]).exists():
+                # Un blob subido como original conserva esa retencion aunque tambien sea un PDF intermedio
+                if row[1] == self.ORIGINAL:
+                    kind = self.ORIGINAL
+                conn.execute("UPDATE blobs SET kind = ?, last_used = ? WHERE id = ?", (kind, now, blob_id))
+                tmp_path.unlink()
+                logger.info("Blob already stored: %s", blob_id)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+                conn.execute(
+                    "INSERT OR REPLACE INTO blobs (id, path, size, kind, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (blob_id, str(path), size, kind, now, now)
+                )
+                logger.info("Blob stored: %s", path)
+            if source is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO derivations (source, derived, created) VALUES (?, ?, ?)",
+                    (source, blob_id, now)
+                )
+            # En la misma transaccion, para que cleanup() no pueda borrar el blob antes de protegerlo
+            if lease is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO leases (lease, blob, created) VALUES (?, ?, ?)", (lease, blob_id, now)
+                )
+        return blob_id
+
+    @contextmanager
+    def lease(self) -> Iterator[str]:
+        """
+        Open a lease that protects the blobs stored or looked up with it from the cleanup until it is released,
+        e.g. during the processing of an upload, from put_stream() until add_reference().
+        The lease is released when the context exits, whether it succeeded or failed.
+
+        Returns:
+            Iterator[str]: The id of the lease.
+        """
+
+        lease_id = uuid.uuid4().hex
+        try:
+            yield lease_id
+        finally:
+            self.release(lease_id)
+
+    def release(self, lease_id: str) -> None:
+        """
+        Release a lease. The retention of its blobs counts from now.
+
+        Args:
+            lease_id (str): The id of the lease.
+
+        Returns:
+            None
+        """
+
+        with sqlite_transaction(self.db_path) as conn:
+            conn.execute(
+                "UPDATE blobs SET last_used = ? WHERE id IN (SELECT blob FROM leases WHERE lease = ?)",
+                (time.time(), lease_id)
+            )
+            conn.execute("DELETE FROM leases WHERE lease = ?", (lease_id,))
+
+    def put_stream(self, stream: BinaryIO, extension: str, kind: str = ORIGINAL, source: Optional[str] = None,
+                   lease: Optional[str] = None) -> str:
+        """
+        Store the content of a stream (e.g. an uploaded file).
+        The content is hashed while it is written to a temporary file, so it is read only once.
+
+        Args:
+            stream (BinaryIO): The stream with the content.
+            extension (str): The extension of the file, e.g. '.pdf'.
+            kind (str): BlobStore.ORIGINAL or BlobStore.DERIVED. Default is BlobStore.ORIGINAL.
+            source (Optional[str]): The id of the original blob, for derived blobs.
+            lease (Optional[str]): The lease that protects the blob from the cleanup, see lease().
+
+        Returns:
+            str: The id of the blob.
+        """
+
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False) as tmp_file:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                tmp_file.write(chunk)
+                size += len(chunk)
+        return self._add(Path(tmp_file.name), digest.hexdigest(), size, extension, kind, source, lease)
+
+    def put_file(self, file_path: str, kind: str = ORIGINAL, source: Optional[str] = None,
+                 lease: Optional[str] = None) -> str:
+        """
+        Move a file into the store. The extension is taken from the file name.
+
+        Args:
+            file_path (str): The path of the file.
+            kind (str): BlobStore.ORIGINAL or BlobStore.DERIVED. Default is BlobStore.ORIGINAL.
+            source (Optional[str]): The id of the original blob, for derived blobs.
+            lease (Optional[str]): The lease that protects the blob from the cleanup, see lease().
+
+        Returns:
+            str: The id of the blob.
+        """
+
+        file = Path(file_path)
+        digest = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        fd, tmp_name = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        shutil.move(file, tmp_path)
+        return self._add(tmp_path, digest.hexdigest(), tmp_path.stat().st_size, file.suffix, kind, source, lease)
+
+    def get_path(self, blob_id: str) -> Optional[str]:
+        """
+        Get the path of a blob and mark it as used.
+
+        Args:
+            blob_id (str): The id of the blob.
+
+        Returns:
+            Optional[str]: The path of the blob, or None if it is not in the store.
+        """
+
+        with closing(connect_sqlite(self.db_path)) as conn:
+            row = conn.execute("SELECT path FROM blobs WHERE id = ?", (blob_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE blobs SET last_used = ? WHERE id = ?", (time.time(), blob_id))
+        return row[0]
+
+    def get_derived(self, source: str, lease: Optional[str] = None) -> Optional[str]:
+        """
+        Get the id of the intermediate PDF generated from an original blob, if it is still stored.
+
+        Args:
+            source (str): The id of the original blob.
+            lease (Optional[str]): The lease that protects the derived blob from the cleanup, see lease().
+
+        Returns:
+            Optional[str]: The id of the derived blob, or None if there is none.
+        """
+
+        with sqlite_transaction(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT blobs.id, blobs.path FROM derivations JOIN blobs ON blobs.id = derivations.derived "
+                "WHERE derivations.source = ?",
+                (source,)
+            ).fetchone()
+            if row is None or not Path(row[1]).exists():
+                return None
+            if lease is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO leases (lease, blob, created) VALUES (?, ?, ?)", (lease, row[0], time.time())
+                )
+        return row[0]
+
+    def add_reference(self, blob_id: str, collection: str, document: str) -> None:
+        """
+        Link a blob to a document ingested in a collection.
+
+        Args:
+            blob_id (str): The id of the blob.
+            collection (str): The name of the collection.
+            document (str): The name of the document.
+
+        Returns:
+            None
+        """
+
+        with closing(connect_sqlite(self.db_path)) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO refs (blob, collection, document, created) VALUES (?, ?, ?, ?)",
+                (blob_id, collection, document, time.time())
+            )
+
+    def drop_references(self, collection: str) -> None:
+        """
+        Remove every reference to a collection, e.g. when the collection is dropped.
+
+        Args:
+            collection (str): The name of the collection.
+
+        Returns:
+            None
+        """
+
+        with closing(connect_sqlite(self.db_path)) as conn:
+            conn.execute("DELETE FROM refs WHERE collection = ?", (collection,))
+        logger.info("References to collection %s removed", collection)
+
+    def cleanup(self) -> Dict:
+        """
+        Remove the blobs that are no longer needed:
+        originals without references older than the orphan retention, intermediate PDFs not used within the derived
+        retention and temporary files left by interrupted uploads. Leased blobs are never removed.
+
+        Returns:
+            Dict: The number of removed files and bytes.
+        """
+
+        now = time.time()
+        removed = {'files': 0, 'bytes': 0}
+        with sqlite_transaction(self.db_path) as conn:
+            # Los ficheros se borran dentro de la transaccion para no competir con _add()
+            conn.execute("DELETE FROM leases WHERE created < ?", (now - LEASE_TIMEOUT,))
+            rows = conn.execute(
+                "SELECT id, path, size FROM blobs "
+                "WHERE ((kind = ? AND last_used < ? AND id NOT IN (SELECT blob FROM refs)) "
+                "OR (kind = ? AND last_used < ?)) AND id NOT IN (SELECT blob FROM leases)",
+                (self.ORIGINAL, now - self.orphan_retention, self.DERIVED, now - self.derived_retention)
+            ).fetchall()
+            for blob_id, path, size in rows:
+                conn.execute("DELETE FROM blobs WHERE id = ?", (blob_id,))
+                conn.execute("DELETE FROM derivations WHERE derived = ?", (blob_id,))
+                path = Path(path)
+                try:
+                    path.unlink()
+                    removed['files'] += 1
+                    removed['bytes'] += size
+                except FileNotFoundError:
+                    pass
+                # Eliminar los directorios de shard vacios
+                for shard in (path.parent, path.parent.parent):
+                    try:
+                        shard.rmdir()
+                    except OSError:
+                        break
+        # Ficheros y directorios temporales (p. ej. de una conversion interrumpida)
+        for tmp_entry in self.tmp_dir.iterdir():
+            try:
+                if tmp_entry.stat().st_mtime >= now - TMP_GRACE:
+                    continue
+                if tmp_entry.is_dir():
+                    shutil.rmtree(tmp_entry)
+                else:
+                    tmp_entry.unlink()
+                removed['files'] += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error("Error removing temporary file %s: %s", tmp_entry, e)
+        if removed['files']:
+            logger.info("Blob cleanup: %s files removed (%s bytes)", removed['files'], removed['bytes'])
+        return removed
+
+    def stats(self) -> Dict:
+        """
+        Get the statistics of the store.
+
+        Returns:
+            Dict: The number of blobs and bytes by kind and the number of references.
+        """
+
+        with closing(connect_sqlite(self.db_path)) as conn:
+            rows = conn.execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM blobs GROUP BY kind").fetchall()
+            references = conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        stats = {kind: {'blobs': 0, 'bytes': 0} for kind in (self.ORIGINAL, self.DERIVED)}
+        for kind, count, size in rows:
+            stats[kind] = {'blobs': count, 'bytes': size}
+        stats['references'] = references
+        return stats
+
+    def start_cleanup(self, interval: Optional[float] = None) -> threading.Thread:
+        """
+        Run cleanup() now and then periodically in a background thread, once per process.
+
+        Args:
+            interval (Optional[float]): Seconds between cleanups, by default $BLOB_CLEANUP_INTERVAL or 1 hour
+
+        Returns:
+            threading.Thread: The thread running the cleanup.
+        """
+
+        # Tras un fork el hilo del proceso padre no esta vivo en el hijo, asi que se vuelve a lanzar
+        if self._cleanup_thread is not None and self._cleanup_thread.is_alive():
+            return self._cleanup_thread
+        interval = float(interval if interval is not None else os.getenv("BLOB_CLEANUP_INTERVAL", "3600"))
+
+        def run():
+            while True:
+                try:
+                    self.cleanup()
+                except (OSError, sqlite3.Error) as e:
+                    logger.error("Error cleaning up the blob store: %s", e)
+                if self._stop_cleanup.wait(interval):
+                    break
+
+        with self._cleanup_lock:
+            if self._cleanup_thread is None or not self._cleanup_thread.is_alive():
+                self._stop_cleanup.clear()
+                self._cleanup_thread = threading.Thread(target=run, name="blob-cleanup", daemon=True)
+                self._cleanup_thread.start()
+        return self._cleanup_thread
+
+    def stop_cleanup(self) -> None:
+        """
+        Stop the background cleanup.
+
+        Returns:
+            None
+        """
+
+        self._stop_cleanup.set()
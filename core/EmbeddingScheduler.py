@@ -0,0 +1,345 @@
+"""
+This module contains the EmbeddingScheduler class, which is responsible for scheduling the calls to the embeddings API
+within the rate limits (requests and tokens per minute) shared by every worker process.
+"""
+
+import os
+import time
+import math
+import random
+import sqlite3
+from enum import IntEnum
+from pathlib import Path
+from typing import Any, Callable, Optional
+from .utils import get_logger, sqlite_transaction
+
+
+logger = get_logger(__name__)
+
+
+class Priority(IntEnum):
+    """
+    Priority of an embedding request.
+    Interactive requests (e.g. /search) are served before bulk requests (e.g. ingestion).
+    """
+
+    INTERACTIVE = 0
+    BULK = 1
+
+
+class EmbeddingScheduler:
+    """
+    EmbeddingScheduler class.
+    This class applies token-bucket limits on requests and tokens per minute to the embeddings API.
+    The buckets live in a local SQLite database so that every process on the node shares the same quota.
+    """
+
+    def __init__(self, db_path: Optional[str] = None,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 max_retries: int = 6,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0,
+                 bulk_reserve: float = 0.1):
+        """
+        Args:
+            db_path (Optional[str]): Path to the shared SQLite store, by default $EMBEDDING_SCHEDULER_DB or './data/embedding_scheduler.db'
+            requests_per_minute (Optional[int]): Requests per minute quota, by default $EMBEDDING_RPM or 3000
+            tokens_per_minute (Optional[int]): Tokens per minute quota, by default $EMBEDDING_TPM or 1000000
+            max_retries (int): Maximum number of retries for transient errors. Default is 6.
+            base_delay (float): Base delay in seconds for the exponential backoff. Default is 0.5.
+            max_delay (float): Maximum delay in seconds for the exponential backoff. Default is 30.0.
+            bulk_reserve (float): Fraction of each bucket that bulk requests cannot use, kept for interactive requests. Default is 0.1.
+
+        Raises:
+            ValueError: If a limit is not greater than 0.
+        """
+
+        self.db_path = db_path if db_path is not None else os.getenv("EMBEDDING_SCHEDULER_DB", "./data/embedding_scheduler.db")
+        self.limits = {
+            "requests": float(requests_per_minute if requests_per_minute is not None
+                              else os.getenv("EMBEDDING_RPM", "3000")),
+            "tokens": float(tokens_per_minute if tokens_per_minute is not None
+                            else os.getenv("EMBEDDING_TPM", "1000000")),
+        }
+        for name, capacity in self.limits.items():
+            if capacity <= 0:
+                raise ValueError(f"The {name} per minute limit must be greater than 0")
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bulk_reserve = bulk_reserve
+        self._init_store()
+
+    def _init_store(self) -> None:
+        """
+        Create the tables of the shared store if they do not exist.
+        Buckets start full so that a fresh node can serve requests immediately.
+
+        Returns:
+            None
+        """
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with sqlite_transaction(self.db_path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS waiters ("
+                "pid INTEGER NOT NULL, priority INTEGER NOT NULL, count INTEGER NOT NULL, "
+                "updated REAL NOT NULL, PRIMARY KEY (pid, priority))"
+            )
+            now = time.time()
+            for name, capacity in self.limits.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                    (name, capacity, now)
+                )
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """
+        Estimate the number of tokens of a text (about 4 characters per token).
+        The estimation is reconciled with the real usage once the response arrives.
+
+        Args:
+            text (str): The text to estimate.
+
+        Returns:
+            int: The estimated number of tokens.
+        """
+
+        return max(1, math.ceil(len(text) / 4))
+
+    def _refill(self, conn: sqlite3.Connection, now: float) -> dict:
+        """
+        Refill the buckets according to the time elapsed since the last update.
+        Must be called inside a transaction.
+
+        Args:
+            conn (sqlite3.Connection): The connection with an open transaction.
+            now (float): The current time.
+
+        Returns:
+            dict: The current level of each bucket.
+        """
+
+        levels = {}
+        for name, level, updated in conn.execute("SELECT name, level, updated FROM buckets").fetchall():
+            capacity = self.limits[name]
+            levels[name] = min(capacity, level + (now - updated) * capacity / 60.0)
+        return levels
+
+    def _interactive_waiting(self, conn: sqlite3.Connection, now: float) -> bool:
+        """
+        Check if any process has interactive requests waiting for quota.
+        Entries not refreshed in the last minute (e.g. from a dead process) are ignored.
+
+        Args:
+            conn (sqlite3.Connection): The connection with an open transaction.
+            now (float): The current time.
+
+        Returns:
+            bool: True if there are interactive requests waiting, False otherwise.
+        """
+
+        row = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM waiters WHERE priority = ? AND updated > ?",
+            (int(Priority.INTERACTIVE), now - 60)
+        ).fetchone()
+        return row[0] > 0
+
+    def _set_waiting(self, priority: Priority, delta: int) -> None:
+        """
+        Register (delta=1) or unregister (delta=-1) a request waiting for quota.
+        A delta of 0 only refreshes the entry so that it is not taken for one of a dead process.
+
+        Args:
+            priority (Priority): The priority of the request.
+            delta (int): The change in the number of waiting requests.
+
+        Returns:
+            None
+        """
+
+        with sqlite_transaction(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO waiters (pid, priority, count, updated) VALUES (?, ?, MAX(?, 0), ?) "
+                "ON CONFLICT (pid, priority) DO UPDATE SET count = MAX(count + ?, 0), updated = ?",
+                (os.getpid(), int(priority), delta, time.time(), delta, time.time())
+            )
+
+    def _try_acquire(self, tokens: int, priority: Priority) -> float:
+        """
+        Try to take one request and the given tokens from the buckets.
+        Requests larger than the part of a bucket they can use (capacity minus the bulk reserve) are capped to it.
+
+        Args:
+            tokens (int): The number of tokens to take.
+            priority (Priority): The priority of the request.
+
+        Returns:
+            float: 0 if the quota was acquired, otherwise the seconds to wait before trying again.
+        """
+
+        with sqlite_transaction(self.db_path) as conn:
+            now = time.time()
+            levels = self._refill(conn, now)
+            reserve = 0.0
+            if priority == Priority.BULK:
+                # Las peticiones interactivas en espera tienen preferencia
+                if self._interactive_waiting(conn, now):
+                    return 0.05
+                reserve = self.bulk_reserve
+            # Una peticion nunca necesita mas de lo que el bucket le deja usar, si no esperaria para siempre
+            needed = {
+                name: min(float(amount), (1.0 - reserve) * self.limits[name])
+                for name, amount in (("requests", 1), ("tokens", tokens))
+            }
+            wait = 0.0
+            for name, amount in needed.items():
+                capacity = self.limits[name]
+                missing = amount + reserve * capacity - levels[name]
+                if missing > 1e-6:     # Tolerancia para errores de redondeo en la recarga
+                    wait = max(wait, missing * 60.0 / capacity)
+            if wait == 0.0:
+                for name, amount in needed.items():
+                    levels[name] -= amount
+            for name, level in levels.items():
+                conn.execute("UPDATE buckets SET level = ?, updated = ? WHERE name = ?", (level, now, name))
+            return wait
+
+    def _adjust_tokens(self, delta: float) -> None:
+        """
+        Adjust the tokens bucket after the real usage is known.
+
+        Args:
+            delta (float): Tokens to give back (positive) or to take (negative).
+
+        Returns:
+            None
+        """
+
+        with sqlite_transaction(self.db_path) as conn:
+            now = time.time()
+            level = self._refill(conn, now)["tokens"] + delta
+            conn.execute(
+                "UPDATE buckets SET level = ?, updated = ? WHERE name = 'tokens'",
+                (min(level, self.limits["tokens"]), now)
+            )
+
+    def _drain(self, pause: float) -> None:
+        """
+        Empty the buckets after a 429 response so that every process backs off together.
+        The levels are set below zero so the buckets stay empty for `pause` seconds.
+
+        Args:
+            pause (float): The seconds during which no quota is available.
+
+        Returns:
+            None
+        """
+
+        with sqlite_transaction(self.db_path) as conn:
+            now = time.time()
+            levels = self._refill(conn, now)
+            for name, capacity in self.limits.items():
+                level = min(levels[name], -pause * capacity / 60.0)
+                conn.execute("UPDATE buckets SET level = ?, updated = ? WHERE name = ?", (level, now, name))
+
+    def acquire(self, tokens: int, priority: Priority = Priority.BULK) -> None:
+        """
+        Block until one request and the given tokens are available.
+
+        Args:
+            tokens (int): The number of tokens to take.
+            priority (Priority): The priority of the request. Default is Priority.BULK.
+
+        Returns:
+            None
+        """
+
+        wait = self._try_acquire(tokens, priority)
+        if wait == 0.0:
+            return
+        if priority == Priority.INTERACTIVE:
+            self._set_waiting(priority, 1)
+        try:
+            while wait > 0.0:
+                # Esperar con un poco de jitter para no despertar a todos los procesos a la vez
+                time.sleep(min(wait, 1.0) + random.uniform(0, 0.05))
+                if priority == Priority.INTERACTIVE:
+                    self._set_waiting(priority, 0)
+                wait = self._try_acquire(tokens, priority)
+        finally:
+            if priority == Priority.INTERACTIVE:
+                self._set_waiting(priority, -1)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """
+        Compute the delay before the next retry (exponential backoff with full jitter).
+        If the server sends a Retry-After header it is used as the minimum delay.
+
+        Args:
+            attempt (int): The number of the current attempt, starting at 0.
+            error (Exception): The error raised by the API.
+
+        Returns:
+            float: The seconds to wait before the next retry.
+        """
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def run(self, call: Callable[[], Any], text: str, priority: Priority = Priority.BULK) -> Any:
+        """
+        Execute a call to the embeddings API within the rate limits, retrying transient errors.
+
+        Args:
+            call (Callable[[], Any]): The function that calls the embeddings API.
+            text (str): The text sent to the API, used to estimate the tokens.
+            priority (Priority): The priority of the request. Default is Priority.BULK.
+
+        Returns:
+            Any: The response of the API.
+
+        Raises:
+            Exception: The last error raised by the API if the retries are exhausted.
+        """
+
+        # Importar openai solo cuando se hace la primera llamada
+        from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+        retryable_errors = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+        tokens = self.estimate_tokens(text)
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority)
+            try:
+                response = call()
+            except retryable_errors as e:
+                if attempt >= self.max_retries:
+                    logger.error("Embedding request failed after %s retries: %s", attempt, e)
+                    raise
+                delay = self._backoff(attempt, e)
+                logger.warning("Embedding request failed (%s), retrying in %.2fs", type(e).__name__, delay)
+                if isinstance(e, RateLimitError):
+                    # Vaciar los buckets compartidos: acquire() esperara el tiempo de backoff en todos los procesos
+                    self._drain(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+                continue
+            usage = getattr(response, "usage", None)
+            used = getattr(usage, "total_tokens", None)
+            if used is not None and used != tokens:
+                self._adjust_tokens(tokens - used)
+            return response
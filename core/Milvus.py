@@ -2,14 +2,19 @@
 This module contains the MilvusManager class, which is responsible for managing the Milvus database.
 """
 
+from __future__ import annotations
 import os
 import json
-from typing import List
-import polars as pl
-from pymilvus import MilvusClient
-from openai import OpenAI
+import threading
+from typing import List, TYPE_CHECKING
+from .EmbeddingScheduler import EmbeddingScheduler, Priority
 from .utils import get_logger
 
+if TYPE_CHECKING:
+    import polars as pl
+    from pymilvus import MilvusClient
+    from openai import OpenAI
+
 
 logger = get_logger(__name__)
 
@@ -17,25 +22,87 @@ class MilvusManager:
     """
     MilvusManager class.
     This class is responsible for managing the Milvus database.
+    The clients are created lazily on first use, so building a MilvusManager does not open any connection.
     """
 
     def __init__(self):
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.model_name = os.getenv("EMBEDDING_MODEL")
-        self.milvus_client = MilvusClient(uri=os.getenv("MILVUS_URL"))
+        self._openai_client = None
+        self._milvus_client = None
+        self._scheduler = None
+        self._lock = threading.Lock()
+
+    @property
+    def openai_client(self) -> OpenAI:
+        """
+        OpenAI client, created on first access.
+        """
+
+        if self._openai_client is None:
+            with self._lock:
+                if self._openai_client is None:
+                    from openai import OpenAI
+                    # Los reintentos los gestiona el EmbeddingScheduler
+                    self._openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+                    logger.info("OpenAI client created")
+        return self._openai_client
+
+    @property
+    def milvus_client(self) -> MilvusClient:
+        """
+        Milvus client, created (and connected) on first access.
+        """
+
+        if self._milvus_client is None:
+            with self._lock:
+                if self._milvus_client is None:
+                    from pymilvus import MilvusClient
+                    self._milvus_client = MilvusClient(uri=os.getenv("MILVUS_URL"))
+                    logger.info("Milvus client connected")
+        return self._milvus_client
+
+    @property
+    def scheduler(self) -> EmbeddingScheduler:
+        """
+        EmbeddingScheduler, created on first access.
+        """
+
+        if self._scheduler is None:
+            with self._lock:
+                if self._scheduler is None:
+                    self._scheduler = EmbeddingScheduler()
+        return self._scheduler
+
+    def warm_up(self) -> None:
+        """
+        Create the clients and open the connections ahead of the first request.
+        Meant to be called in the background once the server is listening.
+
+        Returns:
+            None
+        """
 
-    def create_embeddings(self, text: str) -> List:
+        _ = self.openai_client, self.milvus_client, self.scheduler
+        logger.info("MilvusManager warmed up")
+
+    def create_embeddings(self, text: str, priority: Priority = Priority.BULK) -> List:
         """
         Create embeddings for a given text.
+        The call goes through the EmbeddingScheduler, which applies the rate limits and retries transient errors.
 
         Args:
             text (str): The text to generate embeddings for.
+            priority (Priority): The priority of the request. Default is Priority.BULK.
 
         Returns:
             List: The embeddings generated for the text.
         """
 
-        response = self.openai_client.embeddings.create(input=text, model=self.model_name)
+        response = self.scheduler.run(
+            lambda: self.openai_client.embeddings.create(input=text, model=self.model_name),
+            text,
+            priority
+        )
         response_json = json.loads(response.model_dump_json())
         embeddings = response_json['data'][0]['embedding']
         logger.info("Embedding generated for text")
@@ -77,6 +144,7 @@ class MilvusManager:
             None
         """
 
+        import polars as pl
         dtf = df.with_columns((pl.col("text").map_elements(
             self.create_embeddings, 
             return_dtype=pl.List(pl.Float64))
@@ -109,7 +177,7 @@ class MilvusManager:
                 "range_filter": 0.5 # Range filter to filter out vectors that are not within the search circle
             }
         }
-        query_embedding = self.create_embeddings(input_text)
+        query_embedding = self.create_embeddings(input_text, Priority.INTERACTIVE)
         res = self.milvus_client.search(
             collection_name=collection_name,
             data=[query_embedding],
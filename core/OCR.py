@@ -3,9 +3,11 @@ This module provides functionalities for Optical Character Recognition (OCR).
 """
 
 import subprocess
+import tempfile
+import threading
 from pathlib import Path
-from typing import List, Dict, Union
-import pymupdf
+from typing import List, Dict, Union, Optional
+from .OCRCache import OCRCache
 from .utils import get_logger
 
 
@@ -15,8 +17,27 @@ class OCR:
     """
     OCR class.
     This class provides functionalities for Optical Character Recognition (OCR) in a PDF file.
+    The text of each page is cached (OCRCache), so pages seen before are not processed again.
     """
 
+    _cache: Optional[OCRCache] = None
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def get_cache(cls) -> OCRCache:
+        """
+        Get the OCR cache, created on first use.
+
+        Returns:
+            OCRCache: The cache of the OCR text of each page.
+        """
+
+        if cls._cache is None:
+            with cls._cache_lock:
+                if cls._cache is None:
+                    cls._cache = OCRCache()
+        return cls._cache
+
     @staticmethod
     def _ocr_pdf(input_pdf: Union[str, Path], output_pdf: Union[str, Path], language='eng+spa') -> None:
         """
@@ -49,33 +70,87 @@ class OCR:
             logger.error("Error applying OCR: %s", e)
 
     @classmethod
-    def get_ocr(cls, file_path: str) -> List[Dict]:
+    def _ocr_pages(cls, doc, page_numbers: List[int], language: str) -> Optional[List[bytes]]:
+        """
+        Applies OCR only to the given pages of a document, using a temporary PDF file with those pages.
+
+        Args:
+            doc (pymupdf.Document): The opened PDF document.
+            page_numbers (List[int]): The (0-based) numbers of the pages to process.
+            language (str): The language(s) to use for OCR.
+
+        Returns:
+            Optional[List[bytes]]: The text of each page (UTF-8), or None if OCR failed.
+        """
+
+        import pymupdf
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_pdf = Path(tmp_dir) / 'pages.pdf'
+            output_pdf = Path(tmp_dir) / 'pages_ocr.pdf'
+            subset = pymupdf.open()
+            for number in page_numbers:
+                subset.insert_pdf(doc, from_page=number, to_page=number)
+            subset.save(input_pdf)
+            subset.close()
+            cls._ocr_pdf(input_pdf, output_pdf, language)
+            if not output_pdf.exists():
+                return None
+            ocr_doc = pymupdf.open(output_pdf)
+            texts = [page.get_text().encode('utf-8') for page in ocr_doc]
+            ocr_doc.close()
+        return texts
+
+    @classmethod
+    def get_ocr(cls, file_path: str, language: str = 'eng+spa') -> List[Dict]:
         """
         Extracts text of each page from a PDF file using PyMuPDF.
+        Pages found in the cache skip OCR, the rest are processed together and added to the cache.
+        The input file is not modified.
 
         Args:
             file_path (str): The path to the PDF file.
+            language (str): The language(s) to use for OCR. Default is 'eng+spa' (English and Spanish).
         
         Returns:
             List[Dict]: A list of dictionaries containing the text and metadata of each page.
         """
 
+        import pymupdf
         file = Path(file_path).resolve()
-        cls._ocr_pdf(file, file)
+        cache = cls.get_cache()
+        doc = pymupdf.open(file)  # Abrir el archivo PDF
+        keys = [OCRCache.page_key(page, language) for page in doc]
+        texts = cache.get_many(keys)
+        # Paginas que no estan en cache (una sola vez por clave, aunque se repitan en el documento)
+        missing = {}
+        for number, key in enumerate(keys):
+            if key not in texts and key not in missing:
+                missing[key] = number
+        if missing:
+            ocr_texts = cls._ocr_pages(doc, list(missing.values()), language)
+            if ocr_texts is not None:
+                new_texts = dict(zip(missing.keys(), ocr_texts))
+                cache.put_many(new_texts)
+                texts.update(new_texts)
+                logger.info("OCR applied to %s pages of %s", len(missing), file)
+            else:
+                logger.warning("OCR failed, using the existing text layer of %s", file)
         elements = []
         metadata = {
             'filetype': 'application/pdf',
             'filename': file.name,
             'page_number': 0
         }
-        doc = pymupdf.open(file)  # Abrir el archivo PDF
-        for page in doc:
+        for page, key in zip(doc, keys):
             metadata_copy = metadata.copy()  # Crear una copia del diccionario
             metadata_copy['page_number'] = page.number + 1
+            # Texto de la cache u OCR; si el OCR fallo, el texto que ya tenga la pagina
+            text = texts.get(key)
+            if text is None:
+                text = page.get_text().encode('utf-8')
             elements.append({
                 'metadata': metadata_copy,
-                # Obtener el texto de la página y codificarlo en UTF-8
-                'text': page.get_text().encode('utf-8')
+                'text': text
             })
         doc.close()
         logger.info("Text extracted from %s", file)
@@ -0,0 +1,183 @@
+"""
+This module contains the OCRCache class, which stores the text extracted by OCR for each page,
+keyed by the hash of the rendered page and the OCR language setting.
+"""
+
+import os
+import math
+import time
+import hashlib
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional
+from .utils import get_logger, connect_sqlite, sqlite_transaction
+
+
+logger = get_logger(__name__)
+
+class OCRCache:
+    """
+    OCRCache class.
+    Persistent cache (SQLite) of the OCR text layer of each page, with eviction by size budget (least recently used first).
+    Pages that have been seen before, even in another document, do not need to go through OCR again.
+    """
+
+    OCR_DPI = 300       # Resolución mínima con la que ocrmypdf rasteriza una página
+    MAX_DPI = 600       # Límite del render; el detalle por encima lo cubre el hash de las imágenes
+
+    def __init__(self, db_path: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            db_path (Optional[str]): Path to the SQLite database, by default $OCR_CACHE_DB or './data/ocr_cache.db'
+            max_bytes (Optional[int]): Size budget of the cached texts in bytes, by default $OCR_CACHE_MAX_BYTES or 256 MB
+        """
+
+        self.db_path = db_path if db_path is not None else os.getenv("OCR_CACHE_DB", "./data/ocr_cache.db")
+        self.max_bytes = int(max_bytes if max_bytes is not None
+                             else os.getenv("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self._init_store()
+
+    def _init_store(self) -> None:
+        """
+        Create the tables of the cache if they do not exist.
+
+        Returns:
+            None
+        """
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with sqlite_transaction(self.db_path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "key TEXT PRIMARY KEY, text BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            for name in ("hits", "misses", "evictions"):
+                conn.execute("INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)", (name,))
+
+    @classmethod
+    def _render_dpi(cls, page) -> int:
+        """
+        Get the resolution used to render a page for the key: the resolution of the highest-resolution
+        image on the page (as ocrmypdf does), at least OCR_DPI and at most MAX_DPI.
+
+        Args:
+            page (pymupdf.Page): The page of the PDF file.
+
+        Returns:
+            int: The resolution in DPI.
+        """
+
+        dpi = cls.OCR_DPI
+        for info in page.get_image_info():
+            x0, _, x1, _ = info['bbox']
+            if x1 > x0:
+                dpi = max(dpi, math.ceil(info['width'] * 72 / (x1 - x0)))
+        return min(dpi, cls.MAX_DPI)
+
+    @classmethod
+    def page_key(cls, page, language: str) -> str:
+        """
+        Compute the cache key of a page: hash of the page rendered at the OCR resolution,
+        the raw streams of its images and the OCR language.
+        Any change in what OCR would see (text, fonts, images, filled form fields) changes the key.
+
+        Args:
+            page (pymupdf.Page): The page of the PDF file.
+            language (str): The language(s) used for OCR.
+
+        Returns:
+            str: The key of the page in the cache.
+        """
+
+        dpi = cls._render_dpi(page)
+        pix = page.get_pixmap(dpi=dpi, alpha=False)
+        digest = hashlib.sha256()
+        digest.update(f"{language}:{dpi}:{pix.width}x{pix.height}:{pix.n}:".encode('utf-8'))
+        digest.update(pix.samples_mv)
+        # Las imágenes a resolución completa, por si tienen más detalle que el render
+        for image in page.get_images(full=True):
+            digest.update(page.parent.xref_stream_raw(image[0]) or b'')
+        return digest.hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """
+        Get the cached texts of the given keys and update the hit-rate statistics.
+
+        Args:
+            keys (List[str]): The keys of the pages.
+
+        Returns:
+            Dict[str, bytes]: The texts found in the cache, by key.
+        """
+
+        found = {}
+        hits = 0
+        with sqlite_transaction(self.db_path) as conn:
+            now = time.time()
+            for key in keys:
+                if key in found:
+                    continue
+                row = conn.execute("SELECT text FROM pages WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    found[key] = bytes(row[0])
+                    conn.execute("UPDATE pages SET last_used = ? WHERE key = ?", (now, key))
+            hits = sum(1 for key in keys if key in found)
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'hits'", (hits,))
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'misses'", (len(keys) - hits,))
+        logger.info("OCR cache: %s of %s pages found", hits, len(keys))
+        return found
+
+    def put_many(self, texts: Dict[str, bytes]) -> None:
+        """
+        Store the texts of the given keys and evict the least recently used pages if the size budget is exceeded.
+
+        Args:
+            texts (Dict[str, bytes]): The texts to store, by key.
+
+        Returns:
+            None
+        """
+
+        evicted = 0
+        with sqlite_transaction(self.db_path) as conn:
+            now = time.time()
+            for key, text in texts.items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages (key, text, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, text, len(text), now)
+                )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in conn.execute("SELECT key, size FROM pages ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+                    total -= size
+                    evicted += 1
+                conn.execute("UPDATE stats SET value = value + ? WHERE name = 'evictions'", (evicted,))
+        if evicted:
+            logger.info("OCR cache: %s pages evicted", evicted)
+
+    def stats(self) -> Dict:
+        """
+        Get the statistics of the cache.
+
+        Returns:
+            Dict: hits, misses, hit_rate, evictions, entries, size_bytes and max_bytes.
+        """
+
+        with closing(connect_sqlite(self.db_path)) as conn:
+            values = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        lookups = values["hits"] + values["misses"]
+        return {
+            "hits": values["hits"],
+            "misses": values["misses"],
+            "hit_rate": values["hits"] / lookups if lookups else 0.0,
+            "evictions": values["evictions"],
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
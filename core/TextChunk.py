@@ -2,14 +2,16 @@
 This module contains the TextChunk class, which is used to handle text chunks and add them to a Polars DataFrame
 """
 
+from __future__ import annotations
 import json
 import copy
 import sqlite3
-from typing import List, Dict, Optional, Union
-import polars as pl
-from sqlalchemy import create_engine
+from typing import List, Dict, Optional, Union, TYPE_CHECKING
 from .utils import get_logger
 
+if TYPE_CHECKING:
+    import polars as pl
+
 
 logger = get_logger(__name__)
 
@@ -30,6 +32,7 @@ class TextChunk():
         Returns:
             pl.DataFrame: polars DataFrame with the text chunks
         """
+        import polars as pl
         for item in json_data:
             item['metadata'] = json.dumps(item['metadata'])
             # Decodificar el texto a UTF-8
@@ -57,6 +60,7 @@ class TextChunk():
         Raises:
             TypeError: If new_data is not a DataFrame or a dictionary
         """
+        import polars as pl
         # Inicializar la lista de columnas clave si no se proporciona
         if key_columns is None:
             key_columns = ['metadata', 'text']
@@ -105,6 +109,7 @@ class TextChunk():
             pl.DataFrame: Currently updated polars DataFrame with the new data added or the same DataFrame if the filetype is not supported
         """
 
+        import polars as pl
         filetype = json_data[0]['metadata']['filetype']
         df = None
         if filetype == "application/pdf":
@@ -157,6 +162,8 @@ class TextChunk():
             pl.DataFrame: DataFrame loaded from the SQLite database (current DataFrame)
         """
 
+        import polars as pl
+        from sqlalchemy import create_engine
         conn = create_engine(f"sqlite:///{checkpoint_path}")
         query = f"SELECT * FROM {table_name}"
         data_df = pl.read_database(query=query, connection=conn.connect()).with_row_index('id')
@@ -1,5 +1,8 @@
 from .files_strategy import FileManager, AcceptedFiles, Another
 from .OCR import OCR
+from .OCRCache import OCRCache
+from .BlobStore import BlobStore
 from .TextChunk import TextChunk
 from .Milvus import MilvusManager
+from .EmbeddingScheduler import EmbeddingScheduler, Priority
 from .utils import get_logger, delete_files_directory
\ No newline at end of file
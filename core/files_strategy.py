@@ -7,8 +7,6 @@ import shutil
 from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import Optional
-import requests
-from requests.exceptions import RequestException
 from .utils import get_logger
 
 
@@ -74,6 +72,8 @@ class Another(Strategy):
         if dst_path and dst_dir:
             logger.error("Error: dst_path and dir_name cannot be used at the same time")
             return
+        import requests
+        from requests.exceptions import RequestException
         libre_office_url = os.getenv('LIBRE_OFFICE_URL')
         with open(src_path, 'rb') as file:
             files = {'file': file}
@@ -1,6 +1,8 @@
 import os
 import logging
-from typing import List
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator, List
 from colorlog import ColoredFormatter
 
 
@@ -24,6 +26,28 @@ def get_logger(name: str) -> logging.Logger:
     logger.addHandler(console_handler)
     return logger
 
+def connect_sqlite(db_path: str) -> sqlite3.Connection:
+    # Modo autocommit: las transacciones se abren explicitamente con BEGIN IMMEDIATE
+    # WAL permite leer mientras otro proceso escribe
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+@contextmanager
+def sqlite_transaction(db_path: str) -> Iterator[sqlite3.Connection]:
+    # Transaccion de escritura: bloquea a los demas escritores (de cualquier proceso) hasta el COMMIT
+    conn = connect_sqlite(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
 def list_files_with_subdirectories(directory: str) -> List:
     files = []
     for root_dir, sub_dirs, root_files in os.walk(directory):
@@ -0,0 +1,123 @@
+"""
+Tests for the BlobStore: deduplication, references, leases and the cleanup by retention policy.
+"""
+
+import io
+import os
+import time
+from pathlib import Path
+from core.BlobStore import BlobStore, TMP_GRACE
+
+
+def test_same_content_is_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    first = store.put_stream(io.BytesIO(b'hello'), '.txt')
+    second = store.put_stream(io.BytesIO(b'hello'), '.txt')
+    assert first == second
+    assert Path(store.get_path(first)).read_bytes() == b'hello'
+    assert store.stats()['original'] == {'blobs': 1, 'bytes': 5}
+
+def test_same_content_with_other_extension_is_another_blob(tmp_path):
+    store = BlobStore(str(tmp_path))
+    text = store.put_stream(io.BytesIO(b'print(1)'), '.txt')
+    code = store.put_stream(io.BytesIO(b'print(1)'), '.py')
+    assert text != code
+    assert store.get_path(text).endswith('.txt')
+    assert store.get_path(code).endswith('.py')
+
+def test_converted_pdf_equal_to_an_original_is_recorded_as_derived(tmp_path):
+    store = BlobStore(str(tmp_path))
+    original_pdf = store.put_stream(io.BytesIO(b'%PDF'), '.pdf')
+    docx = store.put_stream(io.BytesIO(b'docx'), '.docx')
+    pdf = tmp_path / 'converted.pdf'
+    pdf.write_bytes(b'%PDF')
+    derived = store.put_file(str(pdf), kind=BlobStore.DERIVED, source=docx)
+    assert derived == original_pdf
+    assert store.get_derived(docx) == original_pdf
+    # Sigue siendo un original: no se expulsa por la retencion de los PDF intermedios
+    assert store.stats()['original']['blobs'] == 2
+
+def test_zero_retention_is_honored(tmp_path):
+    store = BlobStore(str(tmp_path), orphan_retention=0, derived_retention=0)
+    assert store.orphan_retention == 0.0
+    assert store.derived_retention == 0.0
+
+def test_cleanup_keeps_referenced_originals(tmp_path):
+    store = BlobStore(str(tmp_path), orphan_retention=0, derived_retention=0)
+    referenced = store.put_stream(io.BytesIO(b'referenced'), '.txt')
+    orphan = store.put_stream(io.BytesIO(b'orphan'), '.txt')
+    pdf = tmp_path / 'converted.pdf'
+    pdf.write_bytes(b'%PDF')
+    derived = store.put_file(str(pdf), kind=BlobStore.DERIVED, source=referenced)
+    store.add_reference(referenced, 'collection', 'a.txt')
+    time.sleep(0.01)
+    assert store.cleanup()['files'] == 2
+    assert store.get_path(referenced) is not None
+    assert store.get_path(orphan) is None
+    assert store.get_derived(referenced) is None and store.get_path(derived) is None
+    store.drop_references('collection')
+    time.sleep(0.01)
+    assert store.cleanup()['files'] == 1
+    assert list((tmp_path / 'objects').iterdir()) == []
+
+def test_cleanup_keeps_leased_blobs_until_released(tmp_path):
+    store = BlobStore(str(tmp_path), orphan_retention=0, derived_retention=0)
+    with store.lease() as lease:
+        original = store.put_stream(io.BytesIO(b'docx'), '.docx', lease=lease)
+        pdf = tmp_path / 'converted.pdf'
+        pdf.write_bytes(b'%PDF')
+        derived = store.put_file(str(pdf), kind=BlobStore.DERIVED, source=original, lease=lease)
+        time.sleep(0.01)
+        # Limpieza entre put_stream y add_reference: la subida en curso no pierde sus blobs
+        assert store.cleanup()['files'] == 0
+        assert Path(store.get_path(original)).exists()
+        assert store.get_derived(original) == derived
+        store.add_reference(original, 'collection', 'a.docx')
+    with store.lease() as lease:
+        assert store.get_derived(original, lease) == derived
+        time.sleep(0.01)
+        assert store.cleanup()['files'] == 0
+    time.sleep(0.01)
+    assert store.cleanup()['files'] == 1
+    assert store.get_path(original) is not None and store.get_path(derived) is None
+
+def test_lease_is_released_when_processing_fails(tmp_path):
+    store = BlobStore(str(tmp_path), orphan_retention=0)
+    try:
+        with store.lease() as lease:
+            blob = store.put_stream(io.BytesIO(b'upload'), '.txt', lease=lease)
+            raise RuntimeError("ingestion failed")
+    except RuntimeError:
+        pass
+    time.sleep(0.01)
+    assert store.cleanup()['files'] == 1
+    assert store.get_path(blob) is None
+
+def test_cleanup_keeps_recent_temporary_files(tmp_path):
+    store = BlobStore(str(tmp_path), orphan_retention=0, derived_retention=0)
+    conversion = store.tmp_dir / 'conversion'
+    conversion.mkdir()
+    (store.tmp_dir / 'upload.tmp').write_bytes(b'partial')
+    time.sleep(0.01)
+    assert store.cleanup()['files'] == 0
+    assert conversion.exists() and (store.tmp_dir / 'upload.tmp').exists()
+
+def test_cleanup_removes_leftover_temporary_directories(tmp_path):
+    store = BlobStore(str(tmp_path))
+    leftover = store.tmp_dir / 'conversion'
+    leftover.mkdir()
+    (leftover / 'document.pdf').write_bytes(b'%PDF')
+    (store.tmp_dir / 'upload.tmp').write_bytes(b'partial')
+    old = time.time() - TMP_GRACE - 60
+    for entry in (leftover, store.tmp_dir / 'upload.tmp'):
+        os.utime(entry, (old, old))
+    assert store.cleanup()['files'] == 2
+    assert list(store.tmp_dir.iterdir()) == []
+
+def test_cleanup_thread_is_started_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    thread = store.start_cleanup(interval=60)
+    assert store.start_cleanup(interval=60) is thread
+    store.stop_cleanup()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
@@ -0,0 +1,165 @@
+"""
+Tests for the EmbeddingScheduler: token-bucket refill, bulk/interactive priority,
+quota shared across processes, drain after a 429 and usage reconciliation.
+"""
+
+import sys
+import time
+import sqlite3
+import multiprocessing
+from types import SimpleNamespace
+import httpx
+import pytest
+from openai import RateLimitError
+from core.EmbeddingScheduler import EmbeddingScheduler, Priority
+from core.utils import sqlite_transaction
+
+
+class FakeClock:
+    """
+    Clock that only advances when sleep() is called, so the bucket levels are deterministic.
+    """
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def make_scheduler(db_path, **kwargs) -> EmbeddingScheduler:
+    kwargs.setdefault("requests_per_minute", 600)      # 10 peticiones por segundo
+    kwargs.setdefault("tokens_per_minute", 60000)
+    return EmbeddingScheduler(db_path=str(db_path), base_delay=0.01, **kwargs)
+
+def bucket_level(db_path, name: str) -> float:
+    conn = sqlite3.connect(str(db_path))
+    try:
+        return conn.execute("SELECT level FROM buckets WHERE name = ?", (name,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def rate_limit_error(retry_after: str) -> RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    response = httpx.Response(429, request=request, headers={"retry-after": retry_after})
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+def acquire_many(db_path, count: int) -> None:
+    scheduler = make_scheduler(db_path, bulk_reserve=0.0)
+    for _ in range(count):
+        scheduler.acquire(1, Priority.BULK)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "scheduler.db"
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    # core.EmbeddingScheduler es tambien el nombre de la clase exportada, parchear el modulo
+    monkeypatch.setattr(sys.modules["core.EmbeddingScheduler"], "time", fake_clock)
+    return fake_clock
+
+
+def test_bucket_refills_over_time(db_path, clock):
+    scheduler = make_scheduler(db_path, bulk_reserve=0.0)
+    for _ in range(600):
+        assert scheduler._try_acquire(1, Priority.BULK) == 0.0
+    wait = scheduler._try_acquire(1, Priority.BULK)
+    assert wait == pytest.approx(0.1)
+    clock.sleep(wait)
+    assert scheduler._try_acquire(1, Priority.BULK) == 0.0
+
+def test_bulk_keeps_reserve_for_interactive(db_path, clock):
+    scheduler = make_scheduler(db_path, bulk_reserve=0.5)
+    for _ in range(300):
+        assert scheduler._try_acquire(1, Priority.BULK) == 0.0
+    assert scheduler._try_acquire(1, Priority.BULK) > 0.0
+    assert scheduler._try_acquire(1, Priority.INTERACTIVE) == 0.0
+
+def test_bulk_yields_to_waiting_interactive(db_path, clock):
+    scheduler = make_scheduler(db_path)
+    level = bucket_level(db_path, "requests")
+    scheduler._set_waiting(Priority.INTERACTIVE, 1)
+    assert scheduler._try_acquire(1, Priority.BULK) > 0.0
+    assert bucket_level(db_path, "requests") == level
+    scheduler._set_waiting(Priority.INTERACTIVE, -1)
+    assert scheduler._try_acquire(1, Priority.BULK) == 0.0
+
+def test_interactive_waiter_stays_registered_while_waiting(db_path, clock):
+    scheduler = make_scheduler(db_path)
+    scheduler._drain(90.0)      # La peticion interactiva espera mas que el minuto de caducidad
+    waiting = []
+    sleep = clock.sleep
+
+    def sleep_and_check(seconds):
+        sleep(seconds)
+        with sqlite_transaction(str(db_path)) as conn:
+            waiting.append(scheduler._interactive_waiting(conn, clock.time()))
+
+    clock.sleep = sleep_and_check
+    start = clock.time()
+    scheduler.acquire(1, Priority.INTERACTIVE)
+    assert clock.time() - start >= 89.0
+    assert waiting and all(waiting)
+    with sqlite_transaction(str(db_path)) as conn:
+        assert not scheduler._interactive_waiting(conn, clock.time())
+
+def test_request_larger_than_usable_bucket_does_not_hang(db_path):
+    scheduler = make_scheduler(db_path, tokens_per_minute=1000, bulk_reserve=0.1)
+    start = time.time()
+    scheduler.acquire(950, Priority.BULK)
+    assert time.time() - start < 1.0
+
+def test_quota_is_shared_across_processes(db_path):
+    scheduler = make_scheduler(db_path, bulk_reserve=0.0)
+    scheduler._drain(0.0)       # Buckets vacios: cada peticion espera a la recarga
+    context = multiprocessing.get_context("fork")
+    start = time.time()
+    processes = [context.Process(target=acquire_many, args=(db_path, 5)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=10)
+        assert process.exitcode == 0
+    # 10 peticiones a 10 por segundo entre los dos procesos
+    assert time.time() - start >= 0.9
+
+def test_rate_limit_drains_buckets_for_every_process(db_path):
+    scheduler = make_scheduler(db_path)
+    other = make_scheduler(db_path)
+    calls = []
+
+    def call():
+        calls.append(time.time())
+        if len(calls) == 1:
+            raise rate_limit_error("0.5")
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=3))
+
+    scheduler.run(call, "hello world", Priority.INTERACTIVE)
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.45     # Respeta Retry-After
+    scheduler._drain(1.0)
+    assert other._try_acquire(1, Priority.INTERACTIVE) > 0.9
+
+def test_rate_limit_retries_are_bounded(db_path):
+    scheduler = make_scheduler(db_path)
+    scheduler.max_retries = 2
+
+    def call():
+        raise rate_limit_error("0")
+
+    with pytest.raises(RateLimitError):
+        scheduler.run(call, "hello", Priority.INTERACTIVE)
+
+def test_usage_reconciles_estimated_tokens(db_path, clock):
+    scheduler = make_scheduler(db_path, bulk_reserve=0.0)
+    text = "x" * 400    # Estimacion: 100 tokens
+    response = SimpleNamespace(usage=SimpleNamespace(total_tokens=10))
+    scheduler.run(lambda: response, text, Priority.BULK)
+    # Se cobran 100 tokens estimados y se devuelven 90 al conocer el uso real
+    assert bucket_level(db_path, "tokens") == pytest.approx(60000 - 10)
@@ -0,0 +1,65 @@
+"""
+Tests for OCR.get_ocr with the page cache: cached pages skip OCR, repeated pages are processed once
+and the text of each page is mapped back to it. ocrmypdf is replaced by a stub.
+"""
+
+import pymupdf
+import pytest
+from core.OCR import OCR
+from core.OCRCache import OCRCache
+
+
+def make_pdf(path, labels) -> str:
+    doc = pymupdf.open()
+    for label in labels:
+        page = doc.new_page()
+        page.insert_text((72, 72), label)
+    doc.save(path)
+    doc.close()
+    return str(path)
+
+
+@pytest.fixture
+def ocr_calls(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_ocr_pdf(input_pdf, output_pdf, language='eng+spa'):
+        # Simula ocrmypdf: una pagina con el texto reconocido por cada pagina de entrada
+        src = pymupdf.open(input_pdf)
+        labels = [page.get_text().strip() for page in src]
+        src.close()
+        calls.append(labels)
+        out = pymupdf.open()
+        for label in labels:
+            out.new_page().insert_text((72, 72), f"ocr {label}")
+        out.save(output_pdf)
+        out.close()
+
+    monkeypatch.setattr(OCR, "_cache", OCRCache(db_path=str(tmp_path / "ocr_cache.db")))
+    monkeypatch.setattr(OCR, "_ocr_pdf", staticmethod(fake_ocr_pdf))
+    return calls
+
+
+def page_texts(elements) -> list:
+    return [element['text'].decode('utf-8').strip() for element in elements]
+
+
+def test_repeated_page_is_processed_once(tmp_path, ocr_calls):
+    file = make_pdf(tmp_path / "first.pdf", ["PAGE A", "PAGE B", "PAGE A"])
+    elements = OCR.get_ocr(file, 'eng')
+    assert ocr_calls == [["PAGE A", "PAGE B"]]
+    assert page_texts(elements) == ["ocr PAGE A", "ocr PAGE B", "ocr PAGE A"]
+    assert [element['metadata']['page_number'] for element in elements] == [1, 2, 3]
+
+def test_cached_pages_skip_ocr_across_documents(tmp_path, ocr_calls):
+    OCR.get_ocr(make_pdf(tmp_path / "first.pdf", ["PAGE A", "PAGE B"]), 'eng')
+    elements = OCR.get_ocr(make_pdf(tmp_path / "second.pdf", ["PAGE B", "PAGE A"]), 'eng')
+    assert ocr_calls == [["PAGE A", "PAGE B"]]      # El segundo documento no pasa por OCR
+    assert page_texts(elements) == ["ocr PAGE B", "ocr PAGE A"]
+    assert elements[0]['metadata']['filename'] == "second.pdf"
+
+def test_only_missing_pages_are_processed(tmp_path, ocr_calls):
+    OCR.get_ocr(make_pdf(tmp_path / "first.pdf", ["PAGE A"]), 'eng')
+    elements = OCR.get_ocr(make_pdf(tmp_path / "second.pdf", ["PAGE C", "PAGE A", "PAGE C"]), 'eng')
+    assert ocr_calls == [["PAGE A"], ["PAGE C"]]
+    assert page_texts(elements) == ["ocr PAGE C", "ocr PAGE A", "ocr PAGE C"]
@@ -0,0 +1,39 @@
+"""
+Tests for the OCRCache: page keys, hit-rate statistics and eviction by size budget.
+"""
+
+import pymupdf
+import pytest
+from core.OCRCache import OCRCache
+
+
+def make_page(fine_print: str):
+    doc = pymupdf.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "FORM")
+    page.insert_text((300, 500), fine_print, fontsize=0.3)
+    return doc, page
+
+
+def test_page_key_changes_with_fine_print():
+    _doc1, page1 = make_page("Amount: 1234.56")
+    _doc2, page2 = make_page("Amount: 1284.56")
+    assert OCRCache.page_key(page1, 'eng') != OCRCache.page_key(page2, 'eng')
+
+def test_page_key_depends_on_content_and_language():
+    _doc1, page1 = make_page("Amount: 1234.56")
+    _doc2, page2 = make_page("Amount: 1234.56")
+    assert OCRCache.page_key(page1, 'eng') == OCRCache.page_key(page2, 'eng')
+    assert OCRCache.page_key(page1, 'eng') != OCRCache.page_key(page2, 'spa')
+
+def test_hits_misses_and_eviction(tmp_path):
+    cache = OCRCache(db_path=str(tmp_path / "ocr_cache.db"), max_bytes=10)
+    cache.put_many({'a': b'12345'})
+    cache.put_many({'b': b'67890'})
+    assert cache.get_many(['a', 'c']) == {'a': b'12345'}
+    cache.put_many({'c': b'abc'})      # 13 bytes: se expulsa 'b', la menos usada
+    assert cache.get_many(['b']) == {}
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 2, 1)
+    assert stats['hit_rate'] == pytest.approx(1 / 3)
+    assert stats['size_bytes'] <= 10